@@ -0,0 +1,195 @@
+import argparse
+import os
+import sys
+
+#command line entry point for tiling, clustering and exporting maps
+# heavy modules are only imported by the command that needs them so short jobs start quickly
+#
+#	python cli.py tile maps/zelda_1.png --window 16 11 --border 1
+#	python cli.py cluster maps/zelda_1.png --k 6 3 --feats2 ADJ_TILE --weights 1 2 1 1 --workers 4
+#	python cli.py label maps/links_awakening.png --model clusters/zelda_1_cluster_model.npz
+#	python cli.py export maps/zelda_1.png --what ascii --delim ";" --extension txt
+#	python cli.py export maps/zelda_1.png --what ascii --src ascii_maps/zelda_1_ascii.txt --src-delim ";" --name zelda_1_copy
+#	python cli.py importtime --budget 250
+
+#modules that must not be loaded just by importing the project modules
+HEAVY_MODULES = ['matplotlib','sklearn','PIL','tqdm','scipy']
+
+#project modules checked by the import time budget
+PROJECT_MODULES = ['utils','tileset','tile_map_maker','cluster_model','tile_clusterer','map_generator','window_index','pipeline','cli']
+
+#cluster feature names (utils.CL_F keys) for the command line
+FEAT_NAMES = ['ADJ_TILE','WIN_LOC','PART_MIRROR','PIX_REP']
+
+
+#make the tileset, ascii map and windows for each map (decoding and exporting overlap the tiling)
+def cmdTile(args):
+	from pipeline import MapPipeline
+
+	with MapPipeline(args.tilesize, prefetch=args.prefetch, writers=args.writers) as MP:
+		for name, out in MP.iterRun(args.maps, tuple(args.window), drop_tiles=args.drop, border=args.border, calcOffSet=args.offset, DEBUG=args.debug):
+			pass
+	return 0
+
+#cluster the exported tileset of a map and export the labels
+def cmdCluster(args):
+	from tile_map_maker import TileMapMaker
+	from tile_clusterer import TileClusterer
+	from utils import CL_F
+
+	TMM = TileMapMaker(args.map, args.tilesize)
+	ts = TMM.importTileSet(asTileset=True)
+	wm = TMM.importWindows()
+
+	feats = [[CL_F[f] for f in args.feats1],[CL_F[f] for f in args.feats2]]
+	TC = TileClusterer(ts, wm, args.map)
+	c = TC.makeCascClusters(ts, wm, k=args.k, feats=feats, weights=args.weights, workers=args.workers, executor=args.executor)
+	if c is None:
+		return 1
+	for name, sec in TC.feat_times.items():
+		print("-- %s:\t%.3f s" % (name, sec))
+
+	TC.exportTxtCluster(c)
+	TC.exportModel()
+	if not TC.model.portable():
+		print("-- Note:\tthe model uses WIN_LOC so it can only label " + TC.map_name + " (use other --feats2 to label other maps)")
+	if args.img:
+		TC.exportImgCluster(c, ts)
+	return 0
+
+#label a map's exported tileset with a saved cluster model (no refitting)
+def cmdLabel(args):
+	from tile_map_maker import TileMapMaker
+	from tile_clusterer import TileClusterer
+
+	TMM = TileMapMaker(args.map, args.tilesize)
+	ts = TMM.importTileSet(asTileset=True)
+	wm = TMM.importWindows()
+
+	TC = TileClusterer(ts, wm, args.map)
+	TC.importModel(args.model)
+	try:
+		c = TC.predictClusters(ts, wm)
+	except ValueError as e:
+		print("## ERROR! " + str(e) + " ##")
+		return 1
+
+	TC.exportTxtCluster(c)
+	if args.img:
+		TC.exportImgCluster(c, ts)
+	return 0
+
+#re-export previously exported map data (no image decoding or clustering needed)
+def cmdExport(args):
+	from tile_map_maker import TileMapMaker
+
+	TMM = TileMapMaker(args.map, args.tilesize)
+	name = args.name if args.name else TMM.map_name
+	if args.what == 'ascii':
+		am = TMM.importAsciiMap(args.src, delim=args.src_delim, asStr=True)		#strings keep the unknown 'x' tiles
+		TMM.exportAsciiMap(am, name+"_ascii", extension=args.extension, delim=args.delim)
+	elif args.what == 'windows':
+		TMM.exportWindows(TMM.importWindows(), name+"_windows")
+	return 0
+
+#measure the import time of the project modules with python -X importtime
+def cmdImportTime(args):
+	total, modules = measureImportTime(PROJECT_MODULES)
+
+	print("-- Import time:\t%.1f ms (budget %.1f ms)" % (total/1000, args.budget))
+	for name, us in sorted(modules.items(), key=lambda x: x[1], reverse=True)[:args.top]:
+		print("   %8.1f ms\t%s" % (us/1000, name))
+
+	heavy = sorted(set(m.split(".")[0] for m in modules) & set(HEAVY_MODULES))
+	if len(heavy) > 0:
+		print("## ERROR! Heavy modules imported at startup: " + ", ".join(heavy) + " ##")
+		return 1
+	if total/1000 > args.budget:
+		print("## ERROR! Import time over budget! ##")
+		return 1
+	return 0
+
+#run python -X importtime in a fresh process - returns (total us, {top level module: cumulative us})
+def measureImportTime(mods):
+	import subprocess
+	here = os.path.dirname(os.path.abspath(__file__))
+	env = dict(os.environ, PYTHONPATH=here)
+	p = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ",".join(mods)],
+		cwd=here, env=env, capture_output=True, text=True, check=True)
+
+	#lines look like 'import time:  self [us] | cumulative | imported package' (nesting = extra indent)
+	modules = {}
+	total = 0
+	for line in p.stderr.splitlines():
+		if not line.startswith("import time:") or "cumulative" in line:
+			continue
+		parts = line[len("import time:"):].split("|")
+		name = parts[2].rstrip()
+		modules[name.strip()] = int(parts[1])
+		if not name.startswith("  "):		#top level import
+			total += int(parts[1])
+	return total, modules
+
+
+#make the argument parser with a subcommand for each job
+def makeParser():
+	parser = argparse.ArgumentParser(description="Tile, cluster and export fantasy map data")
+	sub = parser.add_subparsers(dest="command")
+	sub.required = True
+
+	p = sub.add_parser("tile", help="make the tileset, ascii map and windows for maps")
+	p.add_argument("maps", nargs="+", help="map image paths")
+	p.add_argument("--tilesize", type=int, default=16)
+	p.add_argument("--window", type=int, nargs=2, default=[16,11], metavar=("W","H"), help="window size in tiles")
+	p.add_argument("--border", type=int, default=0, help="border thickness between windows in pixels")
+	p.add_argument("--drop", type=int, default=5, help="drop tiles seen fewer times than this")
+	p.add_argument("--offset", action="store_true", help="search for the best pixel offset")
+	p.add_argument("--prefetch", type=int, default=2, help="maps decoded ahead of the one being tiled")
+	p.add_argument("--writers", type=int, default=2, help="background export threads")
+	p.add_argument("--debug", action="store_true")
+	p.set_defaults(func=cmdTile)
+
+	p = sub.add_parser("cluster", help="cluster an exported tileset and export the labels")
+	p.add_argument("map", help="map image path (used for the exported file names)")
+	p.add_argument("--tilesize", type=int, default=16)
+	p.add_argument("--k", type=int, nargs=2, default=[10,3], metavar=("K1","K2"))
+	p.add_argument("--feats1", nargs="+", choices=FEAT_NAMES, default=['PIX_REP'])
+	p.add_argument("--feats2", nargs="*", choices=FEAT_NAMES, default=['WIN_LOC'])
+	p.add_argument("--weights", type=float, nargs=4, default=[1,1,1,1])
+	p.add_argument("--workers", type=int, default=1, help="feature families computed at the same time")
+	p.add_argument("--executor", choices=["thread","process"], default="process", help="pool used when workers > 1")
+	p.add_argument("--img", action="store_true", help="also export the cluster image")
+	p.set_defaults(func=cmdCluster)
+
+	p = sub.add_parser("label", help="label an exported tileset with a saved cluster model")
+	p.add_argument("map", help="map image path (used for the exported file names)")
+	p.add_argument("--model", required=True, help="cluster model exported by the cluster command")
+	p.add_argument("--tilesize", type=int, default=16)
+	p.add_argument("--img", action="store_true", help="also export the cluster image")
+	p.set_defaults(func=cmdLabel)
+
+	p = sub.add_parser("export", help="re-export exported map data")
+	p.add_argument("map", help="map image path (used for the exported file names)")
+	p.add_argument("--what", choices=["ascii","windows"], default="ascii")
+	p.add_argument("--tilesize", type=int, default=16)
+	p.add_argument("--name", default=None, help="export name (default = map name)")
+	p.add_argument("--extension", default="csv")
+	p.add_argument("--delim", default=",", help="delimiter of the exported ascii map")
+	p.add_argument("--src", default=None, help="ascii map to re-export (default = the map's exported csv)")
+	p.add_argument("--src-delim", default=",", help="delimiter of the --src ascii map")
+	p.set_defaults(func=cmdExport)
+
+	p = sub.add_parser("importtime", help="check the project import time budget")
+	p.add_argument("--budget", type=float, default=250, help="budget in ms")
+	p.add_argument("--top", type=int, default=10, help="number of slowest modules to show")
+	p.set_defaults(func=cmdImportTime)
+
+	return parser
+
+def main(argv=None):
+	args = makeParser().parse_args(argv)
+	return args.func(args)
+
+
+if __name__ == "__main__":
+	sys.exit(main())
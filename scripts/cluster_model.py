@@ -0,0 +1,93 @@
+import numpy as np
+import os
+from utils import CL_F
+
+#fitted cascade of cluster models (first stage, biggest cluster id, second stage) that can label new tiles
+# stores the cluster centers so new tiles are assigned by nearest center without sklearn or refitting
+class CascClusterModel():
+	# k = [k1, k2], feats = [first feature families, second feature families] (CL_F values)
+	# weights = feature family weights, pix_scale = scaling of the raw pixel values
+	# dims = {feature family: feature width} seen when fitting, map_name = map the model was fit on
+	def __init__(self, k, feats, weights, centers1, big_label=-1, centers2=None, pix_scale=1/256, dims=None, map_name=''):
+		self.k = [int(x) for x in k]
+		self.feats = [[int(f) for f in feats[0]],[int(f) for f in feats[1]]]
+		self.weights = [float(w) for w in weights]
+		self.centers1 = np.asarray(centers1, dtype=np.float64)
+		self.big_label = int(big_label)
+		self.centers2 = None if centers2 is None else np.asarray(centers2, dtype=np.float64)
+		self.pix_scale = float(pix_scale)
+		self.dims = {} if dims is None else {int(f): int(d) for f, d in dims.items()}
+		self.map_name = str(map_name)
+
+	#whether the second (cascade) stage was fit
+	def cascades(self):
+		return self.centers2 is not None
+
+	#feature families needed to predict
+	def families(self):
+		fams = list(self.feats[0])
+		if self.cascades():
+			fams += [f for f in self.feats[1] if f not in fams]
+		return fams
+
+	#whether the model can label tiles of other maps - window location columns are the fitted map's
+	# windows, so window i of another map has nothing to do with them
+	def portable(self):
+		return CL_F['WIN_LOC'] not in self.families()
+
+	#check the model can label the tiles of a map (raises ValueError if not)
+	def checkMap(self, map_name):
+		if not self.portable() and map_name != self.map_name:
+			raise ValueError("The cluster model uses window location features, which only apply to the map it was fit on ('%s'), not '%s' - refit it without WIN_LOC to label other maps" % (self.map_name, map_name))
+
+	#index of the nearest center for every row of X
+	def nearest(self, X, centers):
+		d = (X**2).sum(axis=1)[:,None] - 2*X.dot(centers.T) + (centers**2).sum(axis=1)[None,:]
+		return np.argmin(d, axis=1)
+
+	#stack the selected feature families (checks they match the widths seen when fitting)
+	def featureData(self, all_data, fams):
+		d = []
+		for f in fams:
+			if all_data[f] is None:
+				raise ValueError("Missing feature family %d needed by the cluster model" % f)
+			if f in self.dims and all_data[f].shape[1] != self.dims[f]:
+				raise ValueError("Feature family %d has width %d but the model was fit with width %d" % (f, all_data[f].shape[1], self.dims[f]))
+			d.append(all_data[f])
+		return np.hstack(d)
+
+	#assign tiles to the fitted clusters in one batch - all_data = weighted feature families (indexed by CL_F)
+	def predict(self, all_data):
+		l = self.nearest(self.featureData(all_data, self.feats[0]), self.centers1)
+
+		#second stage for the tiles in the biggest cluster
+		if self.cascades():
+			ind = np.nonzero(l == self.big_label)[0]
+			if len(ind) > 0:
+				l2 = self.nearest(self.featureData(all_data, self.feats[1])[ind], self.centers2)
+				l[ind] = np.where(l2 == 0, self.big_label, self.k[0]+l2-1)
+
+		return l
+
+	#export the model to a npz file
+	def exportModel(self, path):
+		d = os.path.dirname(path)
+		if d != '':
+			os.makedirs(d, exist_ok=True)
+
+		fams = sorted(self.dims.keys())
+		np.savez(path, k=np.array(self.k), feats1=np.array(self.feats[0],dtype=np.int64), feats2=np.array(self.feats[1],dtype=np.int64),
+			weights=np.array(self.weights), centers1=self.centers1, big_label=np.array(self.big_label),
+			centers2=(self.centers2 if self.cascades() else np.zeros((0,0))), pix_scale=np.array(self.pix_scale),
+			dim_fams=np.array(fams,dtype=np.int64), dim_sizes=np.array([self.dims[f] for f in fams],dtype=np.int64),
+			map_name=np.array(self.map_name))
+		return
+
+
+#import a model exported with exportModel
+def importModel(path):
+	d = np.load(path)
+	centers2 = d['centers2'] if d['centers2'].size > 0 else None
+	dims = dict(zip(d['dim_fams'].tolist(), d['dim_sizes'].tolist()))
+	return CascClusterModel(d['k'].tolist(), [d['feats1'].tolist(), d['feats2'].tolist()], d['weights'].tolist(),
+		d['centers1'], int(d['big_label']), centers2, float(d['pix_scale']), dims, str(d['map_name']))
@@ -0,0 +1,369 @@
+import numpy as np
+import os
+import heapq
+import bisect
+
+#directions as (dy,dx) offsets - index order is used by the constraint tables
+DIRS = [(-1,0),(1,0),(0,1),(0,-1)]		#n, s, e, w
+
+#chunk size used for batch generation (fixed so results do not depend on the number of workers)
+BATCH_CHUNK = 64
+
+#worker process state for batch generation
+_WORKER_GEN = None
+
+
+#iterate over the set bit positions of a bitset
+def bitIter(m):
+	while m:
+		low = m & -m
+		yield low.bit_length()-1
+		m ^= low
+
+#number of set bits in a bitset (int.bit_count is python 3.10+)
+if hasattr(int, 'bit_count'):
+	bitCount = int.bit_count
+else:
+	def bitCount(m):
+		return bin(m).count("1")
+
+
+class MapGenerator():
+	# windows = (ny, nx, wh, ww) or (n, wh, ww) window array (from asciiWindows/importWindows)
+	# labels = optional {str(tile): cluster} dict (from makeCascClusters) to generate at cluster level
+	def __init__(self, windows, labels=None, special='x', depth=2, backtracks=1):
+		self.depth = depth			#wfc propagation depth from a changed cell (1 = forward checking, 0 = full arc consistency)
+		self.backtracks = backtracks	#wfc undos allowed per grid cell before restarting
+		w = np.asarray(windows)
+		if w.ndim == 4:
+			w = w.reshape(np.prod(w.shape[:2]),w.shape[2],w.shape[3])
+		self.ws = (w.shape[2],w.shape[1])		#window size (width, height) like asciiWindows
+
+		#convert to the tile values to generate over (tile index or cluster label)
+		uniq, inv = np.unique(w, return_inverse=True)
+		if labels is not None:
+			uniq = np.array([str(labels.get(str(u), special)) for u in uniq])
+
+		#compact integer ids for every value (vocab[id] = original value)
+		self.vocab, remap = np.unique(uniq, return_inverse=True)
+		self.grid = remap.reshape(-1)[inv.reshape(-1)].reshape(w.shape).astype(np.int32)
+
+		self.compileTables()
+
+	#make the frequency, adjacency and constraint tables from the compiled windows
+	def compileTables(self):
+		g = self.grid
+		n = len(self.vocab)
+		self.n = n
+
+		#tile frequencies and adjacency counts (horiz[a,b] = b right of a, vert[a,b] = b below a)
+		self.freq = np.bincount(g.ravel(), minlength=n).astype(np.float64)
+		self.horiz = np.zeros((n,n), dtype=np.int64)
+		self.vert = np.zeros((n,n), dtype=np.int64)
+		np.add.at(self.horiz, (g[:,:,:-1].ravel(), g[:,:,1:].ravel()), 1)
+		np.add.at(self.vert, (g[:,:-1,:].ravel(), g[:,1:,:].ravel()), 1)
+
+		#cumulative markov tables (conditioned on the left tile, the upper tile, or neither)
+		self.cum_freq = np.cumsum(self.freq/self.freq.sum())
+		self.cum_left = self.cumTable(self.horiz)
+		self.cum_up = self.cumTable(self.vert)
+		self.cum_both = {}
+
+		#constraint bitsets (compat[d][a] = tiles allowed in direction d of tile a)
+		adj = [self.vert.T, self.vert, self.horiz, self.horiz.T]
+		self.compat = []
+		for d in range(len(DIRS)):
+			masks = []
+			for a in range(n):
+				m = 0
+				for b in np.nonzero(adj[d][a])[0]:
+					m |= 1 << int(b)
+				masks.append(m)
+			self.compat.append(masks)
+		self.full = (1 << n) - 1
+		self.choices = {}
+		self.nbr_cache = {}
+		self.support = {}
+		self.compat_t = {1 << t: [self.compat[d][t] for d in range(len(DIRS))] for t in range(n)}		#singleton domain => support per direction
+
+	#normalize the rows of a count table into cumulative distributions (falls back to tile frequency)
+	def cumTable(self, counts):
+		c = counts.astype(np.float64)
+		tot = c.sum(axis=1, keepdims=True)
+		c = np.where(tot > 0, c/np.maximum(tot,1), self.freq/self.freq.sum())
+		return np.cumsum(c, axis=1)
+
+	#cumulative distribution for a tile with a known left and upper neighbor
+	def cumBoth(self, left, up):
+		key = (left,up)
+		if key not in self.cum_both:
+			p = self.horiz[left]*self.vert[up]
+			if p.sum() == 0:
+				p = self.horiz[left]+self.vert[up]			#no tile fits both, so take either
+			p = p.astype(np.float64)
+			if p.sum() == 0:
+				p = self.freq							#neither has a known neighbor, so use the tile frequency
+			self.cum_both[key] = np.cumsum(p/p.sum())
+		return self.cum_both[key]
+
+
+
+	#tiles allowed in direction d of any tile in domain m (cached)
+	def supportMask(self, d, m):
+		key = (d,m)
+		s = self.support.get(key)
+		if s is None:
+			s = 0
+			for t in bitIter(m):
+				s |= self.compat[d][t]
+			self.support[key] = s
+		return s
+
+
+
+	#####   SAMPLERS   #####
+
+
+	#sample a (h x w) grid of tile ids with a markov chain on the left and upper neighbors
+	def sampleMarkov(self, h, w, rng):
+		out = np.zeros((h,w), dtype=np.int32)
+		u = rng.random(h*w)
+		n1 = self.n-1
+		i = 0
+		for y in range(h):
+			for x in range(w):
+				if y == 0 and x == 0:
+					cum = self.cum_freq
+				elif y == 0:
+					cum = self.cum_left[out[y,x-1]]
+				elif x == 0:
+					cum = self.cum_up[out[y-1,x]]
+				else:
+					cum = self.cumBoth(out[y,x-1],out[y-1,x])
+				out[y,x] = min(cum.searchsorted(u[i],side='right'),n1)
+				i += 1
+		return out
+
+	#sample a (h x w) grid of tile ids with wave function collapse (bitset constraint propagation)
+	# raises a RuntimeError if every attempt runs out of backtracks (never falls back to another method)
+	def sampleWFC(self, h, w, rng, retries=10):
+		for r in range(retries):
+			out = self.collapse(h, w, rng)
+			if out is not None:
+				return out
+		raise RuntimeError("Wave function collapse could not fill a %dx%d grid in %d attempts (use method='markov' or a smaller size)" % (w, h, retries))
+
+	#one attempt at wave function collapse (returns None if it runs out of backtracks)
+	# every collapsed cell restricts its neighbors, so every adjacent pair is in the tables - changes
+	# spread self.depth cells further (1 = forward checking only, fastest for windows but whole maps
+	# dead end often, 2 = fills whole maps). A contradiction undoes the last choice and bans that tile
+	# from its cell (up to self.backtracks undos per cell of the grid)
+	def collapse(self, h, w, rng):
+		size = h*w
+		if self.n <= 1:
+			return np.zeros((h,w), dtype=np.int32)		#nothing to choose
+
+		nbrs = self.neighbors(h, w)
+		compat_t = self.compat_t
+		support = self.support
+		depth = self.depth
+		dom = [self.full]*size
+		cnt = [self.n]*size
+		noise = rng.random(size)*0.1			#random tie breaking between equal entropy cells
+		heap = [(self.n+noise[i],i) for i in range(size)]		#(entropy, cell) - stale entries are skipped
+		heapq.heapify(heap)
+		trail = []			#(cell, old domain, old count) for every domain change, undone when backtracking
+		choices = []		#(cell, tile, trail length, cells left) for every choice made
+		budget = int(self.backtracks*size)
+		left = size
+
+		#spread the constraints out from the changed cells - returns the cells left (-1 on a contradiction)
+		def propagate(stack, left):
+			while stack:
+				i, r = stack.pop()
+				di = dom[i]
+				sup = compat_t.get(di)			#precomputed for collapsed cells
+				for d, j in nbrs[i]:
+					dj = dom[j]
+					if sup is not None:
+						s = sup[d]
+					else:
+						s = support.get((d,di))
+						if s is None:
+							s = self.supportMask(d,di)
+					m = dj & s
+					if m == dj:
+						continue
+					if m == 0:
+						return -1
+					trail.append((j,dj,cnt[j]))
+					dom[j] = m
+					k = bitCount(m)
+					cnt[j] = k
+					if k == 1:
+						left -= 1				#collapsed by propagation
+						stack.append((j,0))
+					else:
+						heapq.heappush(heap, (k+noise[j],j))
+						if depth == 0 or r+1 < depth:
+							stack.append((j,r+1))
+			return left
+
+		while left > 0:
+			#collapse the cell with the fewest options left
+			e, c = heapq.heappop(heap)
+			if cnt[c] == 1 or e != cnt[c]+noise[c]:
+				continue
+
+			#pick a tile that leaves every neighbor an option (drop tiles that do not and pick again)
+			m = dom[c]
+			while m:
+				opts, cum = self.choiceTable(m)
+				t = opts[min(bisect.bisect(cum, rng.random()*cum[-1]),len(opts)-1)]
+				sup = compat_t[1 << t]
+				if all(dom[j] & sup[d] for d, j in nbrs[c]):
+					break
+				m &= ~(1 << t)
+
+			if m:
+				choices.append((c,t,len(trail),left))
+				trail.append((c,dom[c],cnt[c]))
+				dom[c] = 1 << t
+				cnt[c] = 1
+				left = propagate([(c,0)], left-1)
+			else:
+				heapq.heappush(heap, (e,c))		#still open after backtracking
+				left = -1
+
+			#contradiction - undo the last choice and ban its tile (going further back if that empties the cell)
+			while left < 0:
+				if len(choices) == 0 or budget == 0:
+					return None
+				budget -= 1
+				c, t, mark, left = choices.pop()
+				while len(trail) > mark:
+					j, dj, k = trail.pop()
+					dom[j] = dj
+					cnt[j] = k
+					if k > 1:
+						heapq.heappush(heap, (k+noise[j],j))
+
+				m = dom[c] & ~(1 << t)
+				if m == 0:
+					left = -1
+					continue
+				trail.append((c,dom[c],cnt[c]))
+				dom[c] = m
+				k = bitCount(m)
+				cnt[c] = k
+				if k == 1:
+					left -= 1
+				else:
+					heapq.heappush(heap, (k+noise[c],c))
+				left = propagate([(c,0)], left)
+
+		return np.array([d.bit_length()-1 for d in dom], dtype=np.int32).reshape(h,w)
+
+	#(direction, neighbor cell) lists for every cell of a (h x w) grid (cached)
+	def neighbors(self, h, w):
+		key = (h,w)
+		if key not in self.nbr_cache:
+			nb = []
+			for y in range(h):
+				for x in range(w):
+					l = []
+					for d, (dy, dx) in enumerate(DIRS):
+						if 0 <= y+dy < h and 0 <= x+dx < w:
+							l.append((d,(y+dy)*w+x+dx))
+					nb.append(l)
+			self.nbr_cache[key] = nb
+		return self.nbr_cache[key]
+
+	#tile ids and cumulative frequency weights for a domain bitset (cached)
+	def choiceTable(self, m):
+		t = self.choices.get(m)
+		if t is None:
+			opts = list(bitIter(m))
+			t = (opts, list(np.cumsum(self.freq[opts])))
+			self.choices[m] = t
+		return t
+
+	#sample a grid with the given method
+	# 'markov' is the fastest (thousands of windows/s per core), 'wfc' only places tile pairs seen in the windows
+	def sample(self, h, w, rng, method='markov'):
+		if method == 'markov':
+			return self.sampleMarkov(h, w, rng)
+		elif method == 'wfc':
+			return self.sampleWFC(h, w, rng)
+		raise ValueError("Unknown generation method '%s' (use 'wfc' or 'markov')" % method)
+
+
+
+	#####   GENERATION   #####
+
+
+	#generate a single window in the original tile values
+	def generateWindow(self, method='markov', seed=None):
+		rng = np.random.default_rng(seed)
+		return self.vocab[self.sample(self.ws[1], self.ws[0], rng, method)]
+
+	#generate a whole map of size (width, height) tiles in the original tile values
+	def generateMap(self, size, method='markov', seed=None):
+		rng = np.random.default_rng(seed)
+		return self.vocab[self.sample(size[1], size[0], rng, method)]
+
+	#generate a chunk of n windows as tile ids
+	def generateChunk(self, n, seed, method='markov'):
+		rng = np.random.default_rng(seed)
+		out = np.zeros((n,self.ws[1],self.ws[0]), dtype=np.int32)
+		for i in range(n):
+			out[i] = self.sample(self.ws[1], self.ws[0], rng, method)
+		return out
+
+	#generate n windows (n, wh, ww) - same seed gives the same windows for any number of workers
+	def generateWindows(self, n, method='markov', seed=None, workers=1):
+		seeds = np.random.SeedSequence(seed).spawn(int(np.ceil(n/BATCH_CHUNK)))
+		sizes = [min(BATCH_CHUNK, n-i*BATCH_CHUNK) for i in range(len(seeds))]
+
+		if workers == 1 or len(seeds) <= 1:
+			chunks = [self.generateChunk(s, sd, method) for s, sd in zip(sizes, seeds)]
+		else:
+			from concurrent.futures import ProcessPoolExecutor
+			with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(self,)) as ex:
+				chunks = list(ex.map(_workerChunk, sizes, seeds, [method]*len(seeds)))
+
+		if len(chunks) == 0:
+			return self.vocab[np.zeros((0,self.ws[1],self.ws[0]), dtype=np.int32)]
+		return self.vocab[np.concatenate(chunks)]
+
+
+#setup a batch worker process with its own copy of the generator
+def _initWorker(gen):
+	global _WORKER_GEN
+	_WORKER_GEN = gen
+
+#generate a chunk of windows in a batch worker process
+def _workerChunk(n, seed, method):
+	return _WORKER_GEN.generateChunk(n, seed, method)
+
+
+
+#run demo for the zelda map windows
+if __name__ == "__main__":
+	import time
+	from tile_map_maker import TileMapMaker
+
+	TMM = TileMapMaker('maps/zelda_1.png')
+	MG = MapGenerator(TMM.importWindows())
+	print("-- # tiles:\t" + str(MG.n))
+
+	for method in ['markov','wfc']:
+		st = time.time()
+		w = MG.generateWindows(1000, method=method, seed=42, workers=os.cpu_count())
+		print("-- %s:\t%d windows in %.3f s" % (method, len(w), time.time()-st))
+
+	st = time.time()
+	m = MG.generateMap((48,48), method='wfc', seed=42)
+	print("-- wfc:\t%dx%d map in %.3f s" % (m.shape[1], m.shape[0], time.time()-st))
+
+	print(MG.generateWindow(seed=42))
@@ -0,0 +1,149 @@
+import os
+import threading
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tile_map_maker import TileMapMaker, loadMap
+
+#runs export calls on background threads with a bounded queue
+# submit blocks while the queue is full so exports can not pile up in memory
+class ExportWriter():
+	def __init__(self, writers=2, queue_size=8):
+		self.jobs = queue.Queue(maxsize=queue_size)
+		self.errors = []			#(job name, exception) for failed jobs
+		self.lock = threading.Lock()
+		self.threads = []
+		for i in range(writers):
+			t = threading.Thread(target=self.work, name="export-writer-%d" % i, daemon=True)
+			t.start()
+			self.threads.append(t)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.close(raise_errors=(exc_type is None))		#do not hide the caller's exception
+		return False
+
+	#writer thread loop (None = stop)
+	def work(self):
+		while True:
+			job = self.jobs.get()
+			try:
+				if job is None:
+					return
+				f, args = job
+				f(*args)
+			except Exception as e:
+				with self.lock:
+					self.errors.append((getattr(f,'__name__',str(f)), e))
+			finally:
+				self.jobs.task_done()
+
+	#queue an export call
+	def submit(self, f, *args):
+		if len(self.threads) == 0:
+			raise RuntimeError("Cannot submit to a closed export writer")
+		self.jobs.put((f,args))
+
+	#wait for every queued export to finish and raise the first error (if any)
+	def flush(self):
+		self.jobs.join()
+		with self.lock:
+			errors = self.errors
+			self.errors = []
+		if len(errors) > 0:
+			name, e = errors[0]
+			raise RuntimeError("%d export job(s) failed, first in '%s': %s" % (len(errors), name, e)) from e
+
+	#flush then stop the writer threads
+	def close(self, raise_errors=True):
+		try:
+			self.jobs.join()
+		finally:
+			for t in self.threads:
+				self.jobs.put(None)
+			for t in self.threads:
+				t.join()
+			self.threads = []
+		if raise_errors:
+			self.flush()
+
+
+#processes a corpus of maps with the image decoding, tiling and exporting overlapped
+# the next maps are decoded on a thread pool while the current one is tiled, and exports go to writer threads
+class MapPipeline():
+	def __init__(self, tilesize=16, prefetch=2, writers=2, queue_size=8):
+		self.tsize = tilesize
+		self.prefetch = max(1,prefetch)
+		self.writer = ExportWriter(writers, queue_size)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc, tb):
+		self.writer.close(raise_errors=(exc_type is None))
+		return False
+
+	#run each map as it is decoded - yields (map name, (tileset, ascii map, windows))
+	# TileMapMaker.run arguments (drop_tiles, border, calcOffSet, DEBUG) are passed through
+	def iterRun(self, map_paths, ws, export=True, **run_args):
+		paths = iter(map_paths)
+		decoder = ThreadPoolExecutor(max_workers=self.prefetch)
+		pending = deque()
+		try:
+			#start decoding the first maps
+			for p in paths:
+				pending.append((p, decoder.submit(loadMap, p)))
+				if len(pending) >= self.prefetch:
+					break
+
+			while len(pending) > 0:
+				p, fut = pending.popleft()
+
+				#keep the decoder busy with the next map while this one is processed
+				for nxt in paths:
+					pending.append((nxt, decoder.submit(loadMap, nxt)))
+					break
+
+				TMM = TileMapMaker(p, self.tsize, og_map=fut.result())
+				out = TMM.run(self.tsize, ws, export=False, **run_args)
+				if export:
+					for f, a in TMM.exportJobs(*out):
+						self.writer.submit(f, *a)
+
+				yield TMM.map_name, out
+		finally:
+			for p, fut in pending:
+				fut.cancel()
+			decoder.shutdown(wait=True)
+
+	#run every map and wait for their exports - returns {map name: (tileset, ascii map, windows)}
+	def run(self, map_paths, ws, export=True, **run_args):
+		res = {}
+		for name, out in self.iterRun(map_paths, ws, export, **run_args):
+			res[name] = out
+		self.writer.flush()
+		return res
+
+	#wait for the queued exports (raises the first export error)
+	def flush(self):
+		self.writer.flush()
+
+	#wait for the queued exports and stop the writer threads
+	def close(self):
+		self.writer.close()
+
+
+
+#run demo for the whole map folder
+if __name__ == "__main__":
+	import time
+
+	maps = sorted(os.path.join('maps',m) for m in os.listdir('maps') if m.endswith('.png'))
+
+	st = time.time()
+	with MapPipeline(tilesize=16, prefetch=2, writers=2) as MP:
+		for name, (tset, am, wm) in MP.iterRun(maps, (10,9)):
+			print("-- %s:\t%d tiles, %d windows" % (name, len(tset), wm.shape[0]*wm.shape[1]))
+	print("-- Total:\t%.2f s" % (time.time()-st))
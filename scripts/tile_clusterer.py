@@ -1,13 +1,18 @@
 import numpy as np
-from PIL import Image
 import math
 import os
 from tile_map_maker import TileMapMaker
-from utils import *
-import matplotlib.pyplot as plt
+from utils import CL_F, tile2Color, tile2Str
+from tileset import asTileset
+from cluster_model import CascClusterModel, importModel
 import csv
-from sklearn.cluster import KMeans
 import io
+import time
+
+#heavy dependencies (PIL, matplotlib, sklearn) are imported where they are used to keep startup fast
+
+#scaling of the raw pixel values for the pixel feature
+PIX_SCALE = 1/256
 
 class TileClusterer():
 	def __init__(self,ts, wm, map_path):
@@ -16,6 +21,8 @@ class TileClusterer():
 		self.windows = wm
 		self.dirs = ['n','s','e','w']
 		self.d_map = {'n':(-1,0),'s':(1,0),'w':(0,-1),'e':(0,1)}
+		self.model = None			#fitted cascade from makeCascClusters
+		self.feat_times = {}		#seconds per feature family from the last makeFeatures
 
 
 
@@ -135,8 +142,8 @@ class TileClusterer():
 
 
 	#return whether mirror image of tile exists in the data (2 if mirror itself, 1 if mirror another tile)
-	def almostMirrorTile(self,t,tset,p):
-		a = tile2Color(t,16)   #convert to color for flipping
+	def almostMirrorTile(self,t,tset,p,tsize=16):
+		a = tile2Color(t,tsize)   #convert to color for flipping
 		
 		flipH = tile2Str(np.flip(a,0))
 		flipV = tile2Str(np.flip(a,1))
@@ -158,11 +165,11 @@ class TileClusterer():
 
 	#find whether all tiles have mirror images
 	def allTileAlmostMirror(self, tset,p):
+		tset = asTileset(tset)
 		m = {}
-		tile_ind = list(tset.keys())
-		raw_tiles = list(tset.values())
-		for t in tile_ind:
-			m[str(t)] = self.almostMirrorTile(tset[t],raw_tiles,p)
+		raw_tiles = [tset.tileStr(i) for i in range(len(tset))]
+		for t in range(len(tset)):
+			m[str(t)] = self.almostMirrorTile(raw_tiles[t],raw_tiles,p,tset.tsize)
 		return m
 
 
@@ -170,11 +177,100 @@ class TileClusterer():
 
 
 
+	#make the weighted feature data for one feature family (CL_F value)
+	def familyFeature(self,f,ts,wm,weights=[1,1,1,1],pix_scale=PIX_SCALE):
+		tiles = [str(i) for i in range(len(ts))]          #tile indexes
+
+		#convert dictionary directional percentages to list in consistent format
+		if f == CL_F['ADJ_TILE']:
+			adj_tile_perc = self.allAdjTilePerc(tiles, wm)          #adjacent tiles
+			exp1_data = []
+			for t in tiles:
+				l = []
+				for i in self.dirs:
+					l.append(adj_tile_perc[t][i])
+				exp1_data.append(l)
+			return np.array(exp1_data).reshape(len(tiles),len(self.dirs))*weights[0]
+
+		#convert dictionary window values to list in consistent format
+		if f == CL_F['WIN_LOC']:
+			tile_windows = self.allTileWinLoc(tiles,wm)             #window locations
+			exp2_data = []
+			for t in tiles:
+				exp2_data.append(tile_windows[t])
+			return np.array(exp2_data).reshape(len(tiles),-1)*weights[1]
+
+		#convert dictionary partial mirror tiles to list in consistent format
+		if f == CL_F['PART_MIRROR']:
+			atam = self.allTileAlmostMirror(ts,0.7)                 #mirror data
+			exp3_data = []
+			for t in tiles:
+				exp3_data.append([atam[t]])
+			return np.array(exp3_data).reshape(len(tiles),1)*weights[2]
+
+		#get raw tile representations
+		if f == CL_F['PIX_REP']:
+			return ts.tiles.reshape(len(ts),-1)*pix_scale*weights[3]
+
+		raise ValueError("Unknown feature family %s" % str(f))
+
+
+	#make the weighted feature data for the tileset (list indexed by CL_F, None for families not selected)
+	# f1 = same adjacent tile, f2 = window location, f3 = partial mirror, f4 = pixel data
+	# the families are independent so they run at the same time on a 'process' (default) or 'thread' pool when workers > 1
+	# (process workers read the window tensor from shared memory), seconds per family are kept in self.feat_times
+	# threads only overlap the NumPy-bound families (PART_MIRROR, PIX_REP) - ADJ_TILE and WIN_LOC are python loops holding the GIL
+	def makeFeatures(self,ts,wm,families=list(CL_F.values()),weights=[1,1,1,1],pix_scale=PIX_SCALE,workers=1,executor='process'):
+		ts = asTileset(ts)
+		wm = np.asarray(wm)
+		fams = [f for f in CL_F.values() if f in families]
+		all_data = [None]*len(CL_F)
+		times = {}
+
+		if workers <= 1 or len(fams) <= 1:
+			for f in fams:
+				all_data[f], times[f] = timedFamily(self,f,ts,wm,weights,pix_scale)
+
+		elif executor == 'thread':
+			from concurrent.futures import ThreadPoolExecutor
+			with ThreadPoolExecutor(max_workers=min(workers,len(fams))) as ex:
+				futs = {f: ex.submit(timedFamily,self,f,ts,wm,weights,pix_scale) for f in fams}
+				for f in fams:
+					all_data[f], times[f] = futs[f].result()
+
+		elif executor == 'process':
+			from concurrent.futures import ProcessPoolExecutor
+			from multiprocessing import shared_memory
+			if wm.dtype == object:
+				wm = wm.astype(str)
+
+			#share the window tensor zero-copy with the workers
+			shm = shared_memory.SharedMemory(create=True, size=max(1,wm.nbytes))
+			try:
+				np.ndarray(wm.shape, dtype=wm.dtype, buffer=shm.buf)[...] = wm
+				with ProcessPoolExecutor(max_workers=min(workers,len(fams))) as ex:
+					futs = {f: ex.submit(sharedFamily,f,ts,shm.name,wm.shape,wm.dtype.str,weights,pix_scale) for f in fams}
+					for f in fams:
+						all_data[f], times[f] = futs[f].result()
+			finally:
+				shm.close()
+				shm.unlink()
+
+		else:
+			raise ValueError("Unknown executor '%s' (use 'thread' or 'process')" % executor)
+
+		names = dict((v,k) for k,v in CL_F.items())
+		self.feat_times = dict((names[f],times[f]) for f in fams)
+		return all_data
+
+
 	#forms k cluster groups from the tileset
 	# uses features in first list as initial cluster then second feature set as next cluster
 	# first cluster = k1, internal cluster size = k2
 	# f1 = same adjacent tile, f2 = window location, f3 = partial mirror, f4 = pixel data
-	def makeCascClusters(self,ts,wm,k=[10,3],feats=[[CL_F['PIX_REP']],[CL_F['WIN_LOC']]],weights=[1,1,1,1]):
+	# the fitted cascade is kept in self.model (see exportModel/predictClusters)
+	# workers/executor run the feature families in parallel (see makeFeatures)
+	def makeCascClusters(self,ts,wm,k=[10,3],feats=[[CL_F['PIX_REP']],[CL_F['WIN_LOC']]],weights=[1,1,1,1],workers=1,executor='process'):
 		#error check
 		if (len(feats[0]) == 0):
 			print("## ERROR! Cannot have empty feature selection for first cluster! ##")
@@ -183,62 +279,31 @@ class TileClusterer():
 			print("## ERROR! Cannot have zero clusters for first cluster! ##")
 			return None
 
+		ts = asTileset(ts)
+		tiles = [str(i) for i in range(len(ts))]          #tile indexes
+		cascade = k[1] > 0 and len(feats[1]) != 0
 
-		tiles = list(map(lambda x: str(x), ts.keys()))          #tile indexes
-
-		#feature datas
-		adj_tile_perc = self.allAdjTilePerc(tiles, wm)          #adjacent tiles
-		tile_windows = self.allTileWinLoc(tiles,wm)             #window locations
-		atam = self.allTileAlmostMirror(ts,0.7)                 #mirror data
-		tile_feat = np.array(list(map(lambda x: tile2Color(x,16).flatten()/256,list(ts.values()))))		#raw tile data
+		#feature datas (only the selected families)
+		fams = list(feats[0]) + (list(feats[1]) if cascade else [])
+		all_data = self.makeFeatures(ts,wm,fams,weights,workers=workers,executor=executor)
 
-
-		#create feature data arrays
-		#convert dictionary directional percentages to list in consistent format
-		exp1_data = []
-		for t in tiles:
-			l = []
-			for i in self.dirs:
-				l.append(adj_tile_perc[t][i])
-			exp1_data.append(l)
-		exp1_data = np.array(exp1_data)*weights[0]
-
-		#convert dictionary window values to list in consistent format
-		exp2_data = []
-		for t in tiles:
-			exp2_data.append(tile_windows[t])
-		exp2_data = np.array(exp2_data)*weights[1]
-
-		#convert dictionary partial mirror tiles to list in consistent format
-		exp3_data = []
-		for t in tiles:
-			exp3_data.append([atam[t]])
-		exp3_data = np.array(exp3_data)*weights[2]
-
-		#get raw tile representations
-		exp4_data = []
-		for t in tile_feat:
-			exp4_data.append(t)
-		exp4_data = np.array(exp4_data)*weights[3]
-
-
-		all_data = [exp1_data,exp2_data,exp3_data,exp4_data]
 		first_data = []
 		for i in feats[0]:
 			first_data.append(all_data[i])
 
 		#make cluster first (feature[0] selection)
+		from sklearn.cluster import KMeans
 		cluster = KMeans(n_clusters=k[0]).fit(self.combineData(first_data))
-		l = list(cluster.labels_)
+		l = np.array(cluster.labels_)
+		big_label = -1
+		centers2 = None
 
 		#cascade features for biggest dataset
-		if k[1] > 0 and len(feats[1]) != 0:
-			big_label = max(set(l), key = l.count)
+		if cascade:
+			big_label = np.bincount(l).argmax()
 
 			#get all elements of biggest cluster
-			b_cluster = {}
-			ind = np.squeeze(np.where(l == big_label))
-
+			ind = np.nonzero(l == big_label)[0]
 
 			#get dataset for big cluster items
 			second_data_all = []
@@ -248,22 +313,53 @@ class TileClusterer():
 			sec_data = casc_feat[ind]
 
 			cluster2 = KMeans(n_clusters=k[1]).fit(sec_data)
-			l2 = list(cluster2.labels_)
+			l2 = np.array(cluster2.labels_)
+			centers2 = cluster2.cluster_centers_
 
 			#adjust labels from second dataset
-			for i,a in zip(ind,l2):
-				if a == 0:
-					l[i] = l[i]
-				else:
-					l[i] = k[0]+a-1
-		
+			l[ind] = np.where(l2 == 0, big_label, k[0]+l2-1)
+
+		#keep the fitted cascade to label new tiles later
+		dims = {f: all_data[f].shape[1] for f in fams}
+		self.model = CascClusterModel(k, feats, weights, cluster.cluster_centers_, big_label, centers2, PIX_SCALE, dims, self.map_name)
 
-		tile_labels = dict(zip(tiles,l))
+		tile_labels = dict(zip(tiles,l.tolist()))
 		return tile_labels
 
 
+	#assign the tiles of a tileset to the clusters of a fitted model (no refitting) - same label format as makeCascClusters
+	# models using window location features only label the map they were fit on (ValueError otherwise)
+	def predictClusters(self,ts,wm,model=None,workers=1,executor='process'):
+		if model is None:
+			model = self.model
+		model.checkMap(self.map_name)
+		ts = asTileset(ts)
+		all_data = self.makeFeatures(ts,wm,model.families(),model.weights,model.pix_scale,workers,executor)
+		l = model.predict(all_data)
+		return dict(zip([str(i) for i in range(len(ts))],l.tolist()))
+
+	#export the fitted cluster model
+	def exportModel(self,model=None):
+		if model is None:
+			model = self.model
+		path = "clusters/" + self.map_name + "_cluster_model.npz"
+		model.exportModel(path)
+
+		n = model.k[0] + (model.k[1]-1 if model.cascades() else 0)
+		print("** Exported cluster model to '%s' with %d clusters ** " % (path, n))
+		return
+
+	#import an exported cluster model (and use it as this clusterer's model)
+	def importModel(self,path=None):
+		if path == None:
+			path = "clusters/" + self.map_name + "_cluster_model.npz"
+		self.model = importModel(path)
+		return self.model
+
+
 	#Convert a Matplotlib figure to a PIL Image and return it (from kotchwane)
 	def fig2img(self,fig):
+		from PIL import Image
 		buf = io.BytesIO()
 		fig.savefig(buf)
 		buf.seek(0)
@@ -273,11 +369,13 @@ class TileClusterer():
 
 	#shows the members of the cluster in image form
 	def exportImgCluster(self,c,tiles):
+		import matplotlib.pyplot as plt
 		if not os.path.exists('clusters'):
 			os.makedirs('clusters')
 
 
 		#sort the images to their clusters
+		tiles = asTileset(tiles)
 		clustSet = {}
 		for k,v in c.items():
 			if not v in clustSet:
@@ -299,7 +397,7 @@ class TileClusterer():
 				plt.subplot(s,w,i+1)
 				plt.xticks([], figure=fig)
 				plt.yticks([], figure=fig)
-				plt.imshow(tile2Color(t[i],16).squeeze(),cmap='gray', figure=fig)
+				plt.imshow(t[i],cmap='gray', figure=fig)
 
 			fig.suptitle('Cluster ' + str(c))
 			clustIMG.append(fig)
@@ -343,6 +441,26 @@ class TileClusterer():
 		
 
 
+#compute one feature family and time it - returns (data, seconds)
+def timedFamily(tc,f,ts,wm,weights,pix_scale):
+	st = time.perf_counter()
+	d = tc.familyFeature(f,ts,wm,weights,pix_scale)
+	return d, time.perf_counter()-st
+
+#compute one feature family in a worker process from the shared memory window tensor
+# (pool workers share the parent's resource tracker, so the parent alone unlinks the block)
+def sharedFamily(f,ts,shm_name,shape,dtype,weights,pix_scale):
+	from multiprocessing import shared_memory
+	shm = shared_memory.SharedMemory(name=shm_name)
+	try:
+		wm = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+		res = timedFamily(TileClusterer(ts,wm,''),f,ts,wm,weights,pix_scale)
+		del wm
+		return res
+	finally:
+		shm.close()
+
+
 if __name__ == "__main__":
 	demo = 1
 
@@ -1,17 +1,31 @@
 import numpy as np
-from PIL import Image
 import math
 import os
-from tqdm import tqdm
 import json
-from utils import *
+from utils import tile2Color, tile2Str
+from tileset import Tileset, countTiles, sheet2Tileset
+
+#heavy dependencies (PIL, tqdm) are imported where they are used to keep startup fast
+
+#read in the map image path and parse as integer array [0-255]
+def loadMap(map_path):
+	from PIL import Image
+	return np.array(Image.open(map_path).convert('L'))
 
 class TileMapMaker():
-	def __init__(self, map_path,tilesize=16):
+	def __init__(self, map_path,tilesize=16,og_map=None):
 		self.map_name = os.path.basename(map_path).split(".")[0]
-		self.og_map = np.array(Image.open(map_path).convert('L'))		# read in the map image path and parse as integer array [0-255]
+		self.map_path = map_path
+		self._og_map = og_map		#decoded on first use (unless already decoded, e.g. prefetched)
 		self.tsize = tilesize
 
+	#the original map image (decoded when first needed so importing/exporting does not read the image)
+	@property
+	def og_map(self):
+		if self._og_map is None:
+			self._og_map = loadMap(self.map_path)
+		return self._og_map
+
 	#returns the og map without the border
 	def removeBorder(self, ws, thick=1):
 		bmap = self.og_map[:]
@@ -48,6 +62,7 @@ class TileMapMaker():
 			bmap[:,v] = 0
 
 		#show the image
+		from PIL import Image
 		img = Image.fromarray(bmap, 'L')
 		img.show()
 
@@ -117,8 +132,18 @@ class TileMapMaker():
 
 		return t2
 
+	#count the tiles of a tilemap into a Tileset (all tiles, prune it for the cutoff)
+	def countTileset(self, tilemap):
+		return countTiles(tilemap.reshape(tilemap.shape[0]*tilemap.shape[1],self.tsize,self.tsize))
+
 	#makes an ascii map using the tileset generated
 	def makeAsciiMap(self, tileset, tilemap):
+		#one batch lookup for a Tileset
+		if isinstance(tileset, Tileset):
+			ids = tileset.lookupBatch(tilemap)
+			am = np.where(ids < 0, 'x', ids.astype(str))
+			return am.astype('<U%d' % max(1,len(str(len(tileset)-1))))
+
 		ascii_map = []
 		map_dim = (tilemap.shape[0],tilemap[1])
 
@@ -159,6 +184,10 @@ class TileMapMaker():
 
 	#create a tilesheet image from the tileset
 	def tileset2Sheet(self, tileset):
+		#lay out a Tileset's pixel array directly
+		if isinstance(tileset, Tileset):
+			return self.tiles2Sheet(tileset.tiles)
+
 		tiles = sorted(tileset, key=lambda x: x[1])
 		w = math.ceil(math.sqrt(len(tiles)))
 		h = math.ceil(len(tiles)/w)
@@ -208,13 +237,28 @@ class TileMapMaker():
 
 
 		#export the tilesheet
+		from PIL import Image
 		img_out = Image.fromarray(img2,'L')
 		return img_out, w, h
 
+	#create a tilesheet image from a (n, tsize, tsize) tile array (rows of tiles, zero filled at the end)
+	def tiles2Sheet(self, tiles):
+		n = len(tiles)
+		ts = tiles.shape[1]
+		w = math.ceil(math.sqrt(n))
+		h = math.ceil(n/w)
+
+		img = np.zeros((h*w,ts,ts), dtype='uint8')
+		img[:n] = tiles
+		img = img.reshape(h,w,ts,ts).transpose(0,2,1,3).reshape(h*ts,w*ts)
+
+		from PIL import Image
+		img_out = Image.fromarray(img,'L')
+		return img_out, w, h
+
 	#export the tile set to a png
 	def exportTileSheet(self, tileset,name='tileset'):
-		if not os.path.exists('tilesheets'):
-			os.makedirs('tilesheets')
+		os.makedirs('tilesheets', exist_ok=True)		#safe when writers export in parallel
 
 		sheet, w, h = self.tileset2Sheet(tileset)
 		path = ("tilesheets/" + name + ".png")
@@ -225,8 +269,7 @@ class TileMapMaker():
 
 	#exports the ascii map generated from the tileset to a csv file
 	def exportAsciiMap(self,ascii_map,name='ascii_map',extension='csv',delim=','):
-		if not os.path.exists('ascii_maps'):
-			os.makedirs('ascii_maps')
+		os.makedirs('ascii_maps', exist_ok=True)
 
 		path = "ascii_maps/" + name + "." + extension
 		np.savetxt(path, np.asarray(ascii_map), delimiter=delim,fmt='%s')
@@ -236,8 +279,7 @@ class TileMapMaker():
 	#export the window data to json format
 	def exportWindows(self, windows,name='windows'):
 		#check if folder exists first
-		if not os.path.exists('map_windows'):
-			os.makedirs('map_windows')
+		os.makedirs('map_windows', exist_ok=True)
 
 		i = 0
 		wd = {}
@@ -262,20 +304,29 @@ class TileMapMaker():
 
 		return
 
+	#the export calls for a run's outputs as (function, args) - independent so they can run on writer threads
+	def exportJobs(self, tset, am, wm):
+		return [
+			(self.exportTileSheet, (tset,self.map_name+"_tileset")),
+			(self.exportAsciiMap, (am,self.map_name+"_ascii")),
+			(self.exportWindows, (wm,self.map_name+"_windows")),
+		]
+
 	#finds the best tile set and occurence set based on calculated offset
 	def findBestTileSplit(self,drop_tiles,border=0,ws=None):
 		bestOff = (0,0)
 		oc = None
 		tm = None
 		lowDrop = 100
+		from tqdm import tqdm
 
 		#go through every pixel combination
 		with tqdm(total=(self.tsize**2)) as pbar:
 			for a in range(self.tsize):
 				for b in range(self.tsize):
 					t = self.splitMap2Tiles(offX=a,offY=b,border=border,ws=ws)		#get tiles split from the original map
-					o = self.getTileOccurrences(t)				#get tile occurrences
-					dp = self.tileDropPercentage(o,drop_tiles)
+					o = self.countTileset(t)					#get tile occurrences
+					dp = o.dropPercentage(drop_tiles)
 
 					pbar.update(1)	#update progress bar
 
@@ -293,11 +344,14 @@ class TileMapMaker():
 		#return best found
 		return tm, oc, bestOff, lowDrop
 
-	#import the tileset that was exported (key = index, value = tile (string form))
-	def importTileSet(self,path=None):
+	#import the tileset that was exported (key = index, value = tile (string form), or a Tileset if asTileset)
+	def importTileSet(self,path=None,asTileset=False):
 		if path == None:
 			path = "tilesheets/" + self.map_name + "_tileset.png"
-		tileIMG = np.array(Image.open(path).convert('L'))
+		tileIMG = loadMap(path)
+
+		if asTileset:
+			return sheet2Tileset(tileIMG, self.tsize)
 
 		#split tiles
 		ts = {}
@@ -310,12 +364,16 @@ class TileMapMaker():
 		return ts
 
 	#import the ascii map that was exported 
-	def importAsciiMap(self, path=None):
+	# asStr = keep the tile values as strings (the unknown 'x' tiles can not be integers)
+	def importAsciiMap(self, path=None, delim=',', asStr=False):
 		if path == None:
 			path = "ascii_maps/" + self.map_name + "_ascii.csv"
 
+		if asStr:
+			return np.loadtxt(path, dtype=str, delimiter=delim, ndmin=2)
+
 		#read back in and convert to integer form
-		am = np.genfromtxt(path, delimiter=',').astype(int)
+		am = np.genfromtxt(path, delimiter=delim).astype(int)
 		return am
 
 	#import the windows json that was exported
@@ -367,14 +425,14 @@ class TileMapMaker():
 
 			#get the tileset and tile occurrences (assume offset = (0,0))
 			tm = self.splitMap2Tiles(border=border,ws=ws)
-			oc = self.getTileOccurrences(tm)
-			dp = self.tileDropPercentage(oc,drop_tiles)
+			oc = self.countTileset(tm)
+			dp = oc.dropPercentage(drop_tiles)
 
 			if DEBUG:
 				print("-- Drop %:\t" + str(round(dp,4)) +" %")
 
 		#make the tileset with associated indexes 
-		tset = self.makeTileSet(oc,drop_tiles)
+		tset = oc.prune(drop_tiles)
 		if DEBUG:
 			print("-- # tiles:\t" + str(len(tset)))
 
@@ -391,9 +449,8 @@ class TileMapMaker():
 
 		#export the tileset and ascii map
 		if export:
-			self.exportTileSheet(tset,self.map_name+"_tileset")
-			self.exportAsciiMap(am,self.map_name+"_ascii")
-			self.exportWindows(wm,self.map_name+"_windows")
+			for f, a in self.exportJobs(tset, am, wm):
+				f(*a)
 
 		#return the tileset, ascii map, and windows (also exported out if option given)
 		return tset, am, wm
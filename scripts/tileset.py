@@ -0,0 +1,128 @@
+import numpy as np
+from utils import tile2Color, tile2Str
+
+#compact tileset - contiguous (n, tsize, tsize) uint8 pixels, tile counts and a tile bytes => id index
+# tile ids are the row index into the pixel array
+class Tileset():
+	__slots__ = ('tsize','tiles','counts','index','_keys','_key_ids')
+
+	def __init__(self, tiles, counts=None):
+		self.tiles = np.ascontiguousarray(tiles, dtype=np.uint8)
+		if self.tiles.ndim != 3 or self.tiles.shape[1] != self.tiles.shape[2]:
+			raise ValueError("Tiles must be a (n, tsize, tsize) array, got %s" % str(self.tiles.shape))
+		self.tsize = self.tiles.shape[1]
+		self.counts = np.zeros(len(self.tiles), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+		#hash => id (first id wins for repeated tiles)
+		self.index = {}
+		for i, k in enumerate(tileKeys(self.tiles)):
+			self.index.setdefault(k.tobytes(), i)
+
+		#sorted keys for vectorized batch lookup
+		ids = np.array(sorted(self.index.values()), dtype=np.int64)
+		keys = tileKeys(self.tiles[ids])
+		order = np.argsort(keys)
+		self._keys = keys[order]
+		self._key_ids = ids[order]
+
+	def __len__(self):
+		return len(self.tiles)
+
+	#tile pixels for an id
+	def __getitem__(self, i):
+		return self.tiles[i]
+
+	def __contains__(self, tile):
+		return self.lookup(tile) >= 0
+
+	#id of a (tsize, tsize) tile (-1 if not in the tileset)
+	def lookup(self, tile):
+		return self.index.get(np.ascontiguousarray(tile, dtype=np.uint8).tobytes(), -1)
+
+	#ids for an array of tiles (..., tsize, tsize) in one call (-1 for tiles not in the tileset)
+	def lookupBatch(self, tiles):
+		tiles = np.asarray(tiles, dtype=np.uint8)
+		shape = tiles.shape[:-2]
+		if len(self._keys) == 0:
+			return np.full(shape, -1, dtype=np.int64)
+		keys = tileKeys(tiles.reshape(-1,self.tsize,self.tsize))
+
+		pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys)-1)
+		ids = np.where(self._keys[pos] == keys, self._key_ids[pos], -1)
+		return ids.reshape(shape)
+
+	#percentage of all counted tiles that would be dropped at the cutoff
+	def dropPercentage(self, cutoff=5):
+		tot = self.counts.sum()
+		if tot == 0:
+			return 0
+		return (self.counts[self.counts < cutoff].sum() / tot)*100
+
+	#tileset with only the tiles seen at least cutoff times, from most to least occurring
+	def prune(self, cutoff=5):
+		keep = np.nonzero(self.counts >= cutoff)[0]
+		keep = keep[np.argsort(-self.counts[keep], kind='stable')]
+		return Tileset(self.tiles[keep], self.counts[keep])
+
+	#hex string form of a tile (the string format used by utils)
+	def tileStr(self, i):
+		return tile2Str(self.tiles[i])
+
+	#legacy dict forms - {hex string: index} like makeTileSet and {index: hex string} like importTileSet
+	def toStrDict(self):
+		return {self.tileStr(i): i for i in range(len(self))}
+
+	def toIndexDict(self):
+		return {i: self.tileStr(i) for i in range(len(self))}
+
+
+#fixed width byte keys for tiles (one void scalar per tile - sortable and hashable by bytes)
+def tileKeys(tiles):
+	t = np.ascontiguousarray(tiles, dtype=np.uint8)
+	return t.reshape(len(t),t.shape[1]*t.shape[2]).view(np.dtype((np.void, t.shape[1]*t.shape[2]))).ravel()
+
+#count the unique tiles of a (n, tsize, tsize) tile array - ids ordered by count then first appearance
+def countTiles(tiles):
+	tiles = np.ascontiguousarray(tiles, dtype=np.uint8)
+	if len(tiles) == 0:
+		return Tileset(tiles)
+	u, first, counts = np.unique(tileKeys(tiles), return_index=True, return_counts=True)
+	order = np.lexsort((first,-counts))
+	return Tileset(tiles[first[order]], counts[order])
+
+#make a tileset from a tilesheet image array (tiles read row by row)
+def sheet2Tileset(img, tsize):
+	h = img.shape[0]//tsize
+	w = img.shape[1]//tsize
+	tiles = img[:h*tsize,:w*tsize].reshape(h,tsize,w,tsize).transpose(0,2,1,3).reshape(h*w,tsize,tsize)
+	return Tileset(tiles)
+
+#make a tileset from a legacy dict ({hex string: index} or {index: hex string})
+def dict2Tileset(ts, tsize=None):
+	items = [(v,k) if isinstance(k,str) else (k,v) for k, v in ts.items()]
+	items = sorted(items, key=lambda x: int(x[0]))
+	if tsize is None:
+		tsize = int(round(np.sqrt(len(items[0][1].split(","))))) if len(items) > 0 else 0
+	if len(items) == 0:
+		return Tileset(np.zeros((0,tsize,tsize), dtype=np.uint8))
+	return Tileset(np.array([tile2Color(t,tsize) for i, t in items]))
+
+#use a Tileset as is or convert a legacy dict (tile size taken from the tile strings)
+def asTileset(ts):
+	if isinstance(ts, Tileset):
+		return ts
+	return dict2Tileset(ts)
+
+
+
+#run demo for the zelda map tileset (and the empty tileset left when every tile is dropped)
+if __name__ == "__main__":
+	from tile_map_maker import TileMapMaker
+
+	TMM = TileMapMaker('maps/zelda_1.png')
+	ts = TMM.countTileset(TMM.splitMap2Tiles())
+	print("-- # tiles:\t" + str(len(ts)) + " (" + str(len(ts.prune())) + " after pruning)")
+
+	empty = ts.prune(cutoff=ts.counts.max()+1)
+	print("-- # tiles:\t" + str(len(empty)) + " after pruning everything, lookup = " + str(empty.lookupBatch(ts.tiles[:3])))
+	print("-- # tiles:\t" + str(len(dict2Tileset({}))) + " from an empty dict")
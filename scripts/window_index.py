@@ -0,0 +1,199 @@
+import numpy as np
+import os
+import zlib
+
+#mersenne prime for the minhash permutations (a*x+b mod p stays inside uint64)
+MH_PRIME = (1 << 31) - 1
+
+class WindowIndex():
+	# name = map (or corpus) name, used for the export path next to the windows json
+	# num_perm = minhash signature length, bands = LSH bands (num_perm must divide evenly)
+	def __init__(self, name='windows', num_perm=64, bands=16, seed=1):
+		if num_perm % bands != 0:
+			raise ValueError("num_perm (%d) must be divisible by bands (%d)" % (num_perm, bands))
+
+		self.name = name
+		self.bands = bands
+		rng = np.random.default_rng(seed)
+		self.perm_a = rng.integers(1, MH_PRIME, num_perm, dtype=np.uint64)
+		self.perm_b = rng.integers(0, MH_PRIME, num_perm, dtype=np.uint64)
+
+		#windows and signatures live in buffers with spare rows, so adding windows does not copy the whole index
+		self._windows = None								#(capacity, wh, ww) indexed windows
+		self._sigs = np.zeros((0,num_perm), dtype=np.uint64)		#(capacity, num_perm) minhash signatures
+		self.keys = []									#(map name, window index) for each window
+		self.buckets = [{} for b in range(bands)]		#LSH band hash => window ids
+		self.map_counts = {}							#map name => number of its windows indexed
+
+	def __len__(self):
+		return len(self.keys)
+
+	#(n, wh, ww) indexed windows (None while empty)
+	@property
+	def windows(self):
+		return None if self._windows is None else self._windows[:len(self)]
+
+	#(n, num_perm) minhash signatures
+	@property
+	def sigs(self):
+		return self._sigs[:len(self)]
+
+	#make room for n more windows (capacity doubles so repeated adds stay linear overall)
+	def reserve(self, n, wshape, wdtype):
+		need = len(self)+n
+		dtype = wdtype if self._windows is None else np.promote_types(self._windows.dtype, wdtype)
+		if self._windows is not None and need <= len(self._windows) and dtype == self._windows.dtype:
+			return
+
+		cap = max(need, 2*len(self._sigs), 16)
+		sigs = np.zeros((cap,self._sigs.shape[1]), dtype=np.uint64)
+		sigs[:len(self)] = self.sigs
+		wins = np.zeros((cap,)+wshape, dtype=dtype)
+		if self._windows is not None:
+			wins[:len(self)] = self.windows
+		self._sigs = sigs
+		self._windows = wins
+
+
+	#####   MINHASH   #####
+
+
+	#stable hash for a tile id (python's str hash changes between runs)
+	def tileHash(self, t):
+		return zlib.crc32(str(t).encode())
+
+	#make the bag of tile tokens for a window (nth occurrence of a tile = its own token)
+	def windowTokens(self, w):
+		vals, inv, counts = np.unique(w, return_inverse=True, return_counts=True)
+		h = np.array([self.tileHash(v) for v in vals], dtype=np.uint64)
+
+		#rank of each occurrence within its tile group
+		order = np.argsort(inv.ravel(), kind='stable')
+		starts = np.repeat(np.cumsum(counts)-counts, counts)
+		rank = np.arange(len(order)) - starts
+
+		tok = h[inv.ravel()[order]]*np.uint64(1000003) + rank.astype(np.uint64)
+		return tok % np.uint64(MH_PRIME)
+
+	#minhash signature for a window
+	def signature(self, w):
+		tok = self.windowTokens(w)
+		return ((self.perm_a[:,None]*tok[None,:] + self.perm_b[:,None]) % np.uint64(MH_PRIME)).min(axis=1)
+
+	#LSH band keys for a signature
+	def bandKeys(self, sig):
+		return [b.tobytes() for b in sig.reshape(self.bands,-1)]
+
+
+
+	#####   INDEXING   #####
+
+
+	#add windows to the index - (ny, nx, wh, ww) from asciiWindows/importWindows or (n, wh, ww)
+	def addWindows(self, windows, map_name=None):
+		if map_name is None:
+			map_name = self.name
+		w = np.asarray(windows)
+		if w.ndim == 4:
+			w = w.reshape(np.prod(w.shape[:2]),w.shape[2],w.shape[3])
+
+		if self._windows is not None and w.shape[1:] != self._windows.shape[1:]:
+			raise ValueError("Window size %s does not match the index window size %s" % (str(w.shape[1:]), str(self._windows.shape[1:])))
+
+		#sign and bucket every new window (window indexes continue on from that map's earlier windows)
+		start = len(self.keys)
+		off = self.map_counts.get(map_name,0)
+		self.reserve(len(w), w.shape[1:], w.dtype)
+		for i in range(len(w)):
+			sig = self.signature(w[i])
+			self._sigs[start+i] = sig
+			self._windows[start+i] = w[i]
+			for b, k in enumerate(self.bandKeys(sig)):
+				self.buckets[b].setdefault(k,[]).append(start+i)
+			self.keys.append((map_name,off+i))		#window index matches exportWindows indexing
+		self.map_counts[map_name] = off+len(w)
+
+		return
+
+	#find the top k windows most like the given (wh, ww) window - returns [((map name, window index), score)]
+	def query(self, window, k=5):
+		if len(self) == 0:
+			return []
+		window = np.asarray(window)
+		sig = self.signature(window)
+
+		#candidates share at least one LSH band with the query
+		cand = set()
+		for b, key in enumerate(self.bandKeys(sig)):
+			cand.update(self.buckets[b].get(key,[]))
+		if len(cand) == 0:
+			return []
+		cand = np.array(sorted(cand))
+
+		#re-rank on exact aligned tile equality (ties broken by estimated bag similarity)
+		exact = (self.windows[cand] == window).reshape(len(cand),-1).mean(axis=1)
+		est = (self.sigs[cand] == sig).mean(axis=1)
+		order = np.lexsort((-est,-exact))[:k]
+
+		return [(self.keys[cand[i]], round(float(exact[i]),7)) for i in order]
+
+
+
+	#####   IMPORT/EXPORT   #####
+
+
+	#export the index next to the windows json
+	def exportIndex(self, name=None):
+		if name is None:
+			name = self.name
+		if not os.path.exists('map_windows'):
+			os.makedirs('map_windows')
+
+		path = "map_windows/" + name + "_index.npz"
+		np.savez_compressed(path, name=np.array(self.name), bands=np.array(self.bands),
+			perm_a=self.perm_a, perm_b=self.perm_b, sigs=self.sigs, windows=(self.windows if self.windows is not None else np.zeros((0,0,0))),
+			key_maps=np.array([k[0] for k in self.keys]), key_ids=np.array([k[1] for k in self.keys],dtype=np.int64))
+
+		print("** Exported index to '%s' @ %d windows ** " % (path, len(self)))
+		return
+
+	#import an exported index (the buckets are rebuilt from the signatures)
+	def importIndex(self, path=None):
+		if path == None:
+			path = "map_windows/" + self.name + "_index.npz"
+
+		d = np.load(path)
+		self.name = str(d['name'])
+		self.bands = int(d['bands'])
+		self.perm_a = d['perm_a']
+		self.perm_b = d['perm_b']
+		self._sigs = d['sigs']
+		self._windows = d['windows'] if len(self._sigs) > 0 else None
+		self.keys = list(zip([str(m) for m in d['key_maps']],[int(i) for i in d['key_ids']]))
+		self.map_counts = {}
+		for m, i in self.keys:
+			self.map_counts[m] = max(self.map_counts.get(m,0),i+1)
+
+		self.buckets = [{} for b in range(self.bands)]
+		for i in range(len(self.sigs)):
+			for b, k in enumerate(self.bandKeys(self.sigs[i])):
+				self.buckets[b].setdefault(k,[]).append(i)
+
+		return self
+
+
+
+#run demo for the zelda map windows
+if __name__ == "__main__":
+	from tile_map_maker import TileMapMaker
+
+	TMM = TileMapMaker('maps/zelda_1.png')
+	wm = TMM.importWindows()
+
+	WI = WindowIndex(TMM.map_name)
+	WI.addWindows(wm)
+	WI.exportIndex()
+
+	WI2 = WindowIndex(TMM.map_name).importIndex()
+	print("Imported index: " + str(len(WI2)) + " windows")
+	print("Screens like window 0: " + str(WI2.query(wm[0][0])))